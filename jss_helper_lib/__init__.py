@@ -25,7 +25,8 @@ import os
 import sys
 
 if os.path.isdir('/Library/AutoPkg/JSSImporter'):
-    sys.path.insert(0, '/Library/AutoPkg/JSSImporter')
+    if '/Library/AutoPkg/JSSImporter' not in sys.path:
+        sys.path.insert(0, '/Library/AutoPkg/JSSImporter')
     import jss
 else:
     raise Exception('python-jss is not installed!')
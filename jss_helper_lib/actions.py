@@ -24,11 +24,17 @@ Functions called by jss_helper, implementing all top-level actions.
 from __future__ import absolute_import
 from __future__ import print_function
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import copy
+import functools
 import os.path
+import plistlib
 import sys
+from xml.parsers.expat import ExpatError
 
 if os.path.isdir('/Library/AutoPkg/JSSImporter'):
-    sys.path.insert(0, '/Library/AutoPkg/JSSImporter')
+    if '/Library/AutoPkg/JSSImporter' not in sys.path:
+        sys.path.insert(0, '/Library/AutoPkg/JSSImporter')
     import jss
 else:
     raise Exception('python-jss is not installed!')
@@ -36,60 +42,94 @@ else:
 from .jss_connection import JSSConnection
 from . import tools
 
-# pylint: disable=no-name-in-module
-from Foundation import (NSData,
-                        NSPropertyListSerialization,
-                        NSPropertyListMutableContainersAndLeaves,
-                        NSPropertyListXMLFormat_v1_0)
-# pylint: enable=no-name-in-module
-
 
 # Globals
 # Edit these if you want to change their default values.
 AUTOPKG_PREFERENCES = "~/Library/Preferences/com.github.autopkg.plist"
 PYTHON_JSS_PREFERENCES = (
     "~/Library/Preferences/com.github.sheagcraig.python-jss.plist")
+_AUTOPKG_PREFERENCES_PATH = os.path.expanduser(AUTOPKG_PREFERENCES)
+_PYTHON_JSS_PREFERENCES_PATH = os.path.expanduser(PYTHON_JSS_PREFERENCES)
+# Exclusion search path, and (jss.JSS search method name, heading) for
+# each type of object a group may be excluded from, by group class.
+_EXCLUSION_SEARCHES = {
+    jss.ComputerGroup: (
+        "scope/exclusions/computer_groups/computer_group",
+        (("Policy", "Policies"),
+         ("OSXConfigurationProfile", "Configuration Profiles"))),
+    jss.MobileDeviceGroup: (
+        "scope/exclusions/mobile_device_groups/mobile_device_group",
+        (("MobileDeviceConfigurationProfile",
+          "Mobile Device Configuration Profiles"),))}
+# The only preference keys map_jssimporter_prefs() reads.
+CONNECTION_PREFERENCE_KEYS = (
+    "JSS_URL", "API_USERNAME", "API_PASSWORD", "JSS_VERIFY_SSL",
+    "JSS_SUPPRESS_WARNINGS", "JSS_MIGRATED", "JSS_REPOS")
+
+
+class PlistError(Exception):
+    """Base exception for plist reading and writing errors."""
+    pass
+
+
+class PlistParseError(PlistError):
+    """Error parsing a plist file."""
+    pass
+
+
+class PlistDataError(PlistError):
+    """Error serializing data to a plist."""
+    pass
+
+
+class PlistWriteError(PlistError):
+    """Error writing a plist file."""
+    pass
 
 
 class Plist(dict):
     """Abbreviated plist representation (as a dict)."""
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, keys=None):
         """Init a Plist, optionally from parsing an existing file.
 
         Args:
             filename: String path to a plist file.
+            keys: Optional iterable of top level keys to keep; others
+                are skipped. Defaults to keeping all keys.
         """
         if filename:
-            dict.__init__(self, self.read_file(filename))
+            dict.__init__(self, self.read_file(filename, keys))
         else:
             dict.__init__(self)
             self.new_plist()
 
-    def read_file(self, path):
+    def read_file(self, path, keys=None):
         """Replace internal XML dict with data from plist at path.
 
+        Parsed plists are cached per path and modification time, so
+        rereading an unchanged file costs a stat and a copy.
+
         Args:
             path: String path to a plist file.
+            keys: Optional iterable of top level keys to return. Only
+                these are copied out of the cache, which keeps large
+                preference files (e.g. AutoPkg's) cheap to read.
 
         Raises:
             PlistParseError: Error in reading plist file.
         """
-        # pylint: disable=unused-variable
-        info, pformat, error = (
-            NSPropertyListSerialization.propertyListWithData_options_format_error_(
-                NSData.dataWithContentsOfFile_(os.path.expanduser(path)),
-                NSPropertyListMutableContainersAndLeaves,
-                None,
-                None
-            ))
-        # pylint: enable=unused-variable
-        if info is None:
-            if error is None:
-                error = "Invalid plist file."
+        expanded_path = os.path.expanduser(path)
+        try:
+            mtime = os.path.getmtime(expanded_path)
+        except OSError as error:
             raise PlistParseError("Can't read %s: %s" % (path, error))
 
-        return info
+        info = _load_plist(expanded_path, mtime)
+        if keys is not None:
+            info = {key: info[key] for key in keys if key in info}
+        # Hand out a copy so callers can't mutate the cached data.
+        return copy.deepcopy(info)
 
     def write_plist(self, path):
         """Write plist to path.
@@ -101,19 +141,14 @@ class Plist(dict):
             PlistDataError: There was an error in the data.
             PlistWriteError: Plist could not be written.
         """
-        plist_data, error = NSPropertyListSerialization.dataWithPropertyList_format_options_error_(
-            self,
-            NSPropertyListXMLFormat_v1_0,
-            0,
-            None)
-        if plist_data is None:
-            if error is None:
-                error = "Failed to serialize data to plist."
+        try:
+            plist_data = plistlib.dumps(dict(self), fmt=plistlib.FMT_XML)
+        except (TypeError, ValueError, OverflowError) as error:
             raise PlistDataError(error)
-        else:
-            if not plist_data.writeToFile_atomically_(
-                    os.path.expanduser(path), True):
-                raise PlistWriteError("Failed writing data to %s" % path)
+        try:
+            tools.write_atomically(os.path.expanduser(path), plist_data)
+        except (IOError, OSError):
+            raise PlistWriteError("Failed writing data to %s" % path)
 
     def new_plist(self):
         """Generate a barebones recipe plist."""
@@ -121,23 +156,60 @@ class Plist(dict):
         pass
 
 
+@functools.lru_cache(maxsize=4)
+def _load_plist(path, mtime):
+    """Parse the plist at path.
+
+    Args:
+        path: String absolute path to a plist file.
+        mtime: Modification time of path; only used as part of the
+            cache key so that edited files are reread.
+
+    Returns: The plist's top level object (usually a dict).
+
+    Raises:
+        PlistParseError: Error in reading plist file.
+    """
+    # pylint: disable=unused-argument
+    try:
+        with open(path, "rb") as plist_file:
+            return plistlib.load(plist_file)
+    except (IOError, OSError, ValueError, ExpatError) as error:
+        raise PlistParseError("Can't read %s: %s" % (path, error))
+
+
 def connect():
     """make the connection to the JSS"""
 
     # get AutoPkg configuration settings for JSSImporter,
     # and barring that, get python-jss settings.
-    if os.path.exists(os.path.expanduser(AUTOPKG_PREFERENCES)):
-        autopkg_env = Plist(AUTOPKG_PREFERENCES)
+    if os.path.exists(_AUTOPKG_PREFERENCES_PATH):
+        autopkg_env = Plist(_AUTOPKG_PREFERENCES_PATH,
+                            keys=CONNECTION_PREFERENCE_KEYS)
         connection = map_jssimporter_prefs(autopkg_env)
         print("Preferences: %s\n" % AUTOPKG_PREFERENCES)
-    elif os.path.exists(os.path.expanduser(PYTHON_JSS_PREFERENCES)):
-        jss_env = Plist(PYTHON_JSS_PREFERENCES)
+    elif os.path.exists(_PYTHON_JSS_PREFERENCES_PATH):
+        jss_env = Plist(_PYTHON_JSS_PREFERENCES_PATH,
+                        keys=CONNECTION_PREFERENCE_KEYS)
         connection = map_jssimporter_prefs(jss_env)
         print("Preferences: %s\n" % PYTHON_JSS_PREFERENCES)
     else:
         sys.exit("No python-jss or AutoPKG/JSSImporter configuration "
                      "file!")
     JSSConnection.setup(connection)
+    clear_caches()
+
+
+def clear_caches():
+    """Forget all JSS data cached by this module.
+
+    Lookups and scope indexes are cached for the life of the process so
+    that reports sharing data (e.g. scope_diff) only fetch it once.
+    They belong to the current connection, so clear them whenever it
+    changes.
+    """
+    _resolve.cache_clear()
+    _scope_index.cache_clear()
 
 
 def map_jssimporter_prefs(prefs):
@@ -155,42 +227,42 @@ def map_jssimporter_prefs(prefs):
     return connection
 
 
-def build_argparser():
+def build_argparser(argv=None):
     """Build the argument parser for jss_helper.
 
+    Args:
+        argv: List of the command line arguments which will be parsed.
+            Used to only build the chosen subcommand's arguments.
+            Defaults to sys.argv[1:].
+
     Returns: A configured argparse parser.
     """
     # Create our argument parser
     parser = argparse.ArgumentParser(description="Query the Jamf Pro Server.")
-    parser.add_argument("-v", "--verbose", action="store_true",
-                        help="Verbose output (does nothing at present).")
-    parser.add_argument("--nossl", default=False, action="store_true",
-                        help="Does nothing, because JSS_VERIFY_SSL is now used.")
-    parser.add_argument("--ssl", default=True, action="store_true",
-                        help="Does nothing, because ssl is now the default.")
+    _add_global_arguments(parser)
     subparser = parser.add_subparsers(dest="subparser_name", title="Actions",
                                       metavar="")
 
     subparsers = {}
 
-    jss_connection = JSSConnection.get()
-
     # computer
     subparsers["computer"] = {
         "help": "List all computers, or search for an individual computer.",
-        "func": tools.create_search_func(jss_connection.Computer),
+        "func": _lazy_search("Computer"),
         "args": {"search": {"help": "ID or name (wildcards allowed) of "
                                     "computer.",
                             "default": None,
-                            "nargs": "?"}}}
+                            "nargs": "?",
+                            "type": _id_or_name}}}
     subparsers["configp"] = {
         "help": "List all configuration profiles, or search for an individual "
                 "configuration profile.",
-        "func": tools.create_search_func(jss_connection.OSXConfigurationProfile),
+        "func": _lazy_search("OSXConfigurationProfile"),
         "args": {"search": {"help": "ID or name (wildcards allowed) of "
                                     "profile.",
                             "default": None,
-                            "nargs": "?"}}}
+                            "nargs": "?",
+                            "type": _id_or_name}}}
     subparsers["excluded"] = {
         "help": "List all policies and configuration profiles from which a "
                 "computer group is excluded.",
@@ -202,13 +274,16 @@ def build_argparser():
         "args": {"search": {"help": "ID or name (wildcards allowed) of "
                                     "computer group.",
                             "default": None,
-                            "nargs": "?"},
+                            "nargs": "?",
+                            "type": _id_or_name},
                  "--add": {"help": "Computer ID's or names to add to group. "
                                    "Wildcards may be used.",
-                           "nargs": "*"},
+                           "nargs": "*",
+                           "type": _id_or_name},
                  "--remove": {"help": "Computer ID's or names to remove from "
                                       "group. Wildcards may be used.",
-                              "nargs": "*"},
+                              "nargs": "*",
+                              "type": _id_or_name},
                  "--dry_run": {"help": "Construct the updated XML for the "
                                        "group, but don't save. Prints "
                                        "results.",
@@ -216,25 +291,28 @@ def build_argparser():
     subparsers["imaging_config"] = {
         "help": "List all Casper Imaging computer configurations, or search "
                 "for an individual computer configuration.",
-        "func": tools.create_search_func(jss_connection.ComputerConfiguration),
+        "func": _lazy_search("ComputerConfiguration"),
         "args": {"search": {"help": "ID or name (wildcards allowed) of "
                                     "computer configuration.",
                             "default": None,
-                            "nargs": "?"}}}
+                            "nargs": "?",
+                            "type": _id_or_name}}}
     subparsers["package"] = {
         "help": "List of all packages, or search for an individual package.",
-        "func": tools.create_search_func(jss_connection.Package),
+        "func": _lazy_search("Package"),
         "args": {"search": {"help": "ID or name (wildcards allowed) of "
                                     "package.",
                             "default": None,
-                            "nargs": "?"}}}
+                            "nargs": "?",
+                            "type": _id_or_name}}}
     subparsers["policy"] = {
         "help": "List all policies, or search for an individual policy.",
-        "func": tools.create_search_func(jss_connection.Policy),
+        "func": _lazy_search("Policy"),
         "args": {"search": {"help": "ID or name (wildcards allowed) of "
                                     "policy.",
                             "default": None,
-                            "nargs": "?"}}}
+                            "nargs": "?",
+                            "type": _id_or_name}}}
     subparsers["scoped"] = {
         "help": "List all policies and configuration profiles scoped to a "
                 "computer group.",
@@ -251,22 +329,32 @@ def build_argparser():
                 "configuration profiles.",
         "func": get_group_scope_diff,
         "args": {"group1": {"help": "ID or name of first group."},
-                 "group2": {"help": "ID or name of second group."}}}
+                 "group2": {"help": "ID or name of second group."},
+                 "--set_diff": {"help": "Only list the report lines unique "
+                                        "to each group, ignoring order. "
+                                        "Faster than a full diff for large "
+                                        "reports.",
+                                "action": "store_true"},
+                 "--unified": {"help": "Show a unified diff rather than a "
+                                       "side-by-side one.",
+                               "action": "store_true"}}}
     subparsers["category"] = {
         "help": "List all categories, or search for an individual category.",
-        "func": tools.create_search_func(jss_connection.Category),
+        "func": _lazy_search("Category"),
         "args": {"search": {"help": "ID or name (wildcards allowed) of "
                                     "category.",
                             "default": None,
-                            "nargs": "?"}}}
+                            "nargs": "?",
+                            "type": _id_or_name}}}
     subparsers["md"] = {
         "help": "List all mobile devices, or search for an indvidual mobile "
                 "device.",
-        "func": tools.create_search_func(jss_connection.MobileDevice),
+        "func": _lazy_search("MobileDevice"),
         "args": {"search": {"help": "ID or name (wildcards allowed) of mobile "
                                     "device.",
                             "default": None,
-                            "nargs": "?"}}}
+                            "nargs": "?",
+                            "type": _id_or_name}}}
     subparsers["md_group"] = {
         "help": "List all mobile device groups, or search for an individual "
                 "mobile device group.",
@@ -274,13 +362,16 @@ def build_argparser():
         "args": {"search": {"help": "ID or name (wildcards allowed) of mobile "
                                     "device group.",
                             "default": None,
-                            "nargs": "?"},
+                            "nargs": "?",
+                            "type": _id_or_name},
                  "--add": {"help": "Mobile device ID's or names to add to "
                                    "group. Wildcards may be used.",
-                           "nargs": "*"},
+                           "nargs": "*",
+                           "type": _id_or_name},
                  "--remove": {"help": "Mobile Device ID's or names to remove "
                                       "from group. Wildcards may be used.",
-                              "nargs": "*"},
+                              "nargs": "*",
+                              "type": _id_or_name},
                  "--dry_run": {"help": "Construct the updated XML for the "
                                        "group, but don't save. Prints "
                                        "results.",
@@ -288,12 +379,12 @@ def build_argparser():
     subparsers["md_configp"] = {
         "help": "List all mobile device configuration profiles, or search for "
                 "an individual mobile device configuration profile.",
-        "func": tools.create_search_func(
-            jss_connection.MobileDeviceConfigurationProfile),
+        "func": _lazy_search("MobileDeviceConfigurationProfile"),
         "args": {"search": {"help": "ID or name (wildcards allowed) of mobile "
                                     "device configuration profile.",
                             "default": None,
-                            "nargs": "?"}}}
+                            "nargs": "?",
+                            "type": _id_or_name}}}
     subparsers["md_scoped"] = {
         "help": "List all mobile device configuration profiles scoped to a "
                 "mobile device group.",
@@ -304,27 +395,96 @@ def build_argparser():
                 "scoped mobile device configuration profiles.",
         "func": get_md_scope_diff,
         "args": {"group1": {"help": "ID or name of first group."},
-                 "group2": {"help": "ID or name of second group."}}}
+                 "group2": {"help": "ID or name of second group."},
+                 "--set_diff": {"help": "Only list the report lines unique "
+                                        "to each group, ignoring order. "
+                                        "Faster than a full diff for large "
+                                        "reports.",
+                                "action": "store_true"},
+                 "--unified": {"help": "Show a unified diff rather than a "
+                                       "side-by-side one.",
+                               "action": "store_true"}}}
     subparsers["md_excluded"] = {
         "help": "List all configuration profiles from which a mobile device "
                 "group is excluded.",
         "func": get_md_excluded,
         "args": {"group": {"help": "ID or name of group."}}}
 
+    # Only the chosen subcommand needs its arguments added; the others
+    # just have to be listed in the help.
+    chosen = _get_chosen_command(argv)
+
     sorted_subparsers = sorted(subparsers)
     for command in sorted_subparsers:
         sub = subparser.add_parser(command, help=subparsers[command]["help"],
                                    description=subparsers[command]["help"])
-        for arg in subparsers[command]["args"]:
-            sub.add_argument(arg, **subparsers[command]["args"][arg])
-        sub.set_defaults(func=subparsers[command]["func"])
+        if command == chosen:
+            for arg in subparsers[command]["args"]:
+                sub.add_argument(arg, **subparsers[command]["args"][arg])
+            sub.set_defaults(func=subparsers[command]["func"])
 
     # More complicated parsers.
+    complex_subparsers = (
+        ("batch_scope", "Scope a list of policies to a group.",
+         _add_batch_scope_arguments),
+        ("promote", "Promote a package from development to production by "
+                    "updating an existing production policy with a newer "
+                    "package.",
+         _add_promote_arguments))
+    for command, arg_help, add_arguments in complex_subparsers:
+        sub = subparser.add_parser(command, help=arg_help,
+                                   description=arg_help)
+        if command == chosen:
+            add_arguments(sub)
+
+    return parser
+
+
+def _add_global_arguments(parser):
+    """Add the options which come before the subcommand to a parser."""
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Verbose output (does nothing at present).")
+    parser.add_argument("--nossl", default=False, action="store_true",
+                        help="Does nothing, because JSS_VERIFY_SSL is now used.")
+    parser.add_argument("--ssl", default=True, action="store_true",
+                        help="Does nothing, because ssl is now the default.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of concurrent requests to make to the "
+                        "JSS. Defaults to $JSS_MAX_WORKERS, or %s."
+                        % tools.DEFAULT_MAX_WORKERS)
+    parser.add_argument("--cache_dir", default=None,
+                        help="Keep JSS responses in this directory between "
+                        "runs, and only download objects again once they "
+                        "change. Defaults to $JSS_HELPER_CACHE_DIR, or no "
+                        "cache.")
 
-    # Batch Scope
-    arg_help = "Scope a list of policies to a group."
-    batch_scope_subparser = subparser.add_parser(
-        "batch_scope", help=arg_help, description=arg_help)
+
+def _get_chosen_command(argv=None):
+    """Return the subcommand named in argv, or None.
+
+    argv is pre-parsed with only the global options, so that their
+    values are never mistaken for the subcommand.
+
+    Args:
+        argv: List of command line arguments. Defaults to
+            sys.argv[1:].
+
+    Returns:
+        String subcommand name, or None if there isn't one.
+    """
+    pre_parser = argparse.ArgumentParser(add_help=False, exit_on_error=False)
+    _add_global_arguments(pre_parser)
+    pre_parser.add_argument("command", nargs="?")
+    # Leave malformed global options for the full parser to report.
+    try:
+        known_args, _ = pre_parser.parse_known_args(argv)
+    except argparse.ArgumentError:
+        return None
+    return known_args.command
+
+
+def _add_batch_scope_arguments(batch_scope_subparser):
+    """Add the batch_scope subcommand's arguments to its parser."""
     batch_scope_subparser.add_argument(
         "group", help="Name, ID, or wildcard search of group to scope "
                       "policies.")
@@ -333,11 +493,9 @@ def build_argparser():
     batch_scope_subparser.add_argument("policy", help=arg_help, nargs="*")
     batch_scope_subparser.set_defaults(func=batch_scope)
 
-    # Promote
-    arg_help = ("Promote a package from development to production by updating "
-                "an existing production policy with a newer package.")
-    promote_subparser = subparser.add_parser(
-        "promote", help=arg_help, description=arg_help)
+
+def _add_promote_arguments(promote_subparser):
+    """Add the promote subcommand's arguments to its parser."""
     promote_subparser.add_argument("policy", help="Policy name or ID.",
                                    nargs="?", default=None)
     promote_subparser.add_argument("new_package", help="Package name or ID.",
@@ -354,7 +512,82 @@ def build_argparser():
                                    action="store_true")
     promote_subparser.set_defaults(func=promote)
 
-    return parser
+
+def _id_or_name(search):
+    """Argparse type which converts numeric searches to integer IDs.
+
+    IDs skip wildcard detection and go straight to a single GET.
+
+    Args:
+        search: String search argument.
+
+    Returns:
+        An int for all-digit searches, otherwise search unchanged.
+    """
+    return int(search) if search.isdecimal() else search
+
+
+def _lazy_search(obj_type):
+    """Build a search func that looks up its JSS method when run.
+
+    Building the argparser shouldn't require a JSS connection, so the
+    search method is only resolved once the chosen subcommand runs.
+
+    Args:
+        obj_type: String name of a jss.JSS search method (e.g.
+            "Computer").
+
+    Returns:
+        A function that takes one argument of Argparser args, as
+        returned by tools.create_search_func.
+    """
+    def search_func(args):
+        """Search the JSS with the named search method."""
+        obj_method = JSSConnection.search_method(obj_type)
+        tools.create_search_func(obj_method)(args)
+
+    return search_func
+
+
+@functools.lru_cache(maxsize=512)
+def _resolve(obj_type, search):
+    """Look up a single JSS object, caching it for the process.
+
+    Only use this for objects which won't be modified, as the same
+    instance is handed to every caller.
+
+    Args:
+        obj_type: String name of a jss.JSS search method (e.g.
+            "ComputerGroup").
+        search: Name or ID to search for.
+
+    Returns:
+        The JSSObject found.
+    """
+    return getattr(JSSConnection.get(), obj_type)(search)
+
+
+@functools.lru_cache(maxsize=None)
+def _scope_index(obj_type):
+    """Retrieve and index all scopable objects of one type.
+
+    The index is built once per process, so reports for several groups
+    (e.g. scope_diff) share a single retrieval and scan. Call
+    _scope_index.cache_clear() to invalidate it.
+
+    Args:
+        obj_type: String name of a jss.JSS search method for a
+            scopable object type (e.g. "Policy").
+
+    Returns:
+        Tuple of (dict, list) as returned by tools.index_scope().
+    """
+    # Only the scope is needed (and general, for the id and name), so
+    # skip downloading and holding the rest of every object.
+    scopables = tools.retrieve_all_parallel(
+        JSSConnection.listing(obj_type),
+        subset=tools.SCOPE_SUBSET)
+    return tools.index_scope(scopables)
 
 
 def get_scoped(args):
@@ -364,43 +597,58 @@ def get_scoped(args):
         args: argparser args with properties:
             group: Name or ID of computer group.
     """
-    print(_get_scoped(args.group))
+    sys.stdout.write(_get_scoped(args.group))
+    sys.stdout.write("\n")
 
 
-def _get_scoped(search_group):
+def _get_scoped(search_group, scoped_to_all=True):
     """Return all policies and config profiles scoped to a group.
 
     Args:
-        args: argparser args with properties:
-            group: Name or ID of computer group.
+        search_group: Name or ID of computer group.
+        scoped_to_all: Bool whether to include the objects scoped to
+            all computers. Defaults to True.
 
     Returns:
         Formatted string report.
     """
-    jss_connection = JSSConnection.get()
-    group = jss_connection.ComputerGroup(search_group)
+    group = _resolve("ComputerGroup", search_group)
+    if scoped_to_all:
+        policies_to_all, configps_to_all = _get_scoped_to_all()
+    parts = []
 
     # Search for policies.
-    policies = jss_connection.Policy().retrieve_all()
-    policy_results = tools.find_groups_in_scope([group], policies)
+    policies_by_group = _scope_index("Policy")[0]
+    policy_results = tools.get_indexed_scope(policies_by_group, group)
     policy_heading = "Policies scoped to %s" % group.name
-    output = tools.build_results_string(policy_heading, policy_results) + "\n"
-
-    policy_results = tools.get_scoped_to_all(policies)
-    policy_heading = "Policies scoped to all computers"
-    output += tools.build_results_string(policy_heading, policy_results) + "\n"
+    parts.append(tools.build_results_string(policy_heading, policy_results))
+    if scoped_to_all:
+        parts.append(policies_to_all)
 
     # Search for configuration profiles.
-    configps = jss_connection.OSXConfigurationProfile().retrieve_all()
-    configp_results = tools.find_groups_in_scope([group], configps)
+    configps_by_group = _scope_index("OSXConfigurationProfile")[0]
+    configp_results = tools.get_indexed_scope(configps_by_group, group)
     configp_heading = "Configuration profiles scoped to %s" % group.name
-    output += (tools.build_results_string(configp_heading, configp_results) +
-               "\n")
-    configp_results = tools.get_scoped_to_all(configps)
-    configp_heading = "Configuration profiles scoped to all computers"
-    output += tools.build_results_string(configp_heading, configp_results)
+    parts.append(tools.build_results_string(configp_heading, configp_results))
+    if scoped_to_all:
+        parts.append(configps_to_all)
+
+    return "\n".join(parts)
 
-    return output
+
+def _get_scoped_to_all():
+    """Return reports of policies and profiles scoped to all computers.
+
+    Returns:
+        Tuple of formatted string reports: (policies, configuration
+        profiles).
+    """
+    policy_heading = "Policies scoped to all computers"
+    configp_heading = "Configuration profiles scoped to all computers"
+    return (
+        tools.build_results_string(policy_heading, _scope_index("Policy")[1]),
+        tools.build_results_string(
+            configp_heading, _scope_index("OSXConfigurationProfile")[1]))
 
 
 def get_md_scoped(args):
@@ -410,31 +658,38 @@ def get_md_scoped(args):
         args: argparser args with properties:
             group: Name or ID of group.
     """
-    print(_get_md_scoped(args.group))
+    sys.stdout.write(_get_md_scoped(args.group))
+    sys.stdout.write("\n")
 
 
-def _get_md_scoped(search_group):
+def _get_md_scoped(search_group, scoped_to_all=True):
     """Return all mobile device config profiles scoped to a group.
 
     Args:
-        args: argparser args with properties:
-            group: Name or ID of group.
+        search_group: Name or ID of mobile device group.
+        scoped_to_all: Bool whether to include the profiles scoped to
+            all mobile devices. Defaults to True.
 
     Returns:
         Formatted string report.
     """
-    jss_connection = JSSConnection.get()
-    group = jss_connection.MobileDeviceGroup(search_group)
+    group = _resolve("MobileDeviceGroup", search_group)
+
+    configps_by_group = _scope_index("MobileDeviceConfigurationProfile")[0]
+    results = tools.get_indexed_scope(configps_by_group, group)
+    parts = [tools.build_results_string("Profiles scoped to %s" % group.name,
+                                        results)]
+    if scoped_to_all:
+        parts.append(_get_md_scoped_to_all())
 
-    configps = jss_connection.MobileDeviceConfigurationProfile().retrieve_all()
-    results = tools.find_groups_in_scope([group], configps)
-    output = tools.build_results_string("Profiles scoped to %s" % group.name,
-                                        results) + "\n"
-    results = tools.get_scoped_to_all(configps)
-    output += tools.build_results_string(
-        "Profiles scoped to all mobile devices", results)
+    return "\n".join(parts)
 
-    return output
+
+def _get_md_scoped_to_all():
+    """Return a report of profiles scoped to all mobile devices."""
+    return tools.build_results_string(
+        "Profiles scoped to all mobile devices",
+        _scope_index("MobileDeviceConfigurationProfile")[1])
 
 
 def get_group_scope_diff(args):
@@ -444,10 +699,15 @@ def get_group_scope_diff(args):
         args: argparser args with properties:
             group1: Name or ID of first computer group.
             group2: Name or ID of second computer group.
+            set_diff: Bool whether to only list unique lines.
+            unified: Bool whether to show a unified diff.
     """
-    results1 = _get_scoped(args.group1)
-    results2 = _get_scoped(args.group2)
-    print(tools.diff(results1, results2))
+    # Objects scoped to all computers are the same for both groups, so
+    # show them once rather than diffing them.
+    results1 = _get_scoped(args.group1, scoped_to_all=False)
+    results2 = _get_scoped(args.group2, scoped_to_all=False)
+    _print_diff(args, results1, results2)
+    print("\n".join(_get_scoped_to_all()))
 
 
 def get_md_scope_diff(args):
@@ -457,10 +717,39 @@ def get_md_scope_diff(args):
         args: argparser args with properties:
             group1: Name or ID of first group.
             group2: Name or ID of second group.
+            set_diff: Bool whether to only list unique lines.
+            unified: Bool whether to show a unified diff.
+    """
+    results1 = _get_md_scoped(args.group1, scoped_to_all=False)
+    results2 = _get_md_scoped(args.group2, scoped_to_all=False)
+    _print_diff(args, results1, results2)
+    print(_get_md_scoped_to_all())
+
+
+def _print_diff(args, results1, results2):
+    """Print the differences between two groups' reports.
+
+    Args:
+        args: argparser args with properties:
+            group1: Name or ID of first group.
+            group2: Name or ID of second group.
+            set_diff: Bool whether to only list unique lines.
+            unified: Bool whether to show a unified diff.
+        results1: String report for group1.
+        results2: String report for group2.
     """
-    results1 = _get_md_scoped(args.group1)
-    results2 = _get_md_scoped(args.group2)
-    print(tools.diff(results1, results2))
+    if args.set_diff:
+        only_in_1, only_in_2 = tools.diff_set(results1, results2)
+        for group, lines in ((args.group1, only_in_1),
+                             (args.group2, only_in_2)):
+            print("Only in %s:" % group)
+            print("\n".join(lines) if lines else "No results found.")
+            print()
+    elif args.unified:
+        print(tools.diff_unified(results1, results2,
+                                 str(args.group1), str(args.group2)))
+    else:
+        print(tools.diff(results1, results2))
 
 
 def batch_scope(args):
@@ -472,17 +761,43 @@ def batch_scope(args):
             policy: List of ID's or names of policies to scope.
                 Wildcard searches accepted.
     """
-    jss_connection = JSSConnection.get()
-    groups = tools.search_for_object(jss_connection.ComputerGroup, args.group)
+    groups = tools.search_for_object(
+        JSSConnection.search_method("ComputerGroup"), args.group)
     print("Scoping to groups: %s" % ", ".join([group.name for group in groups]))
     print(79 * "-")
-    for policy_query in args.policy:
-        policies = tools.search_for_object(jss_connection.Policy, policy_query)
-        for policy in policies:
-            for group in groups:
-                policy.add_object_to_scope(group)
-            policy.save()
-            print("%s: Success." % policy.name)
+    # Searches may overlap (e.g. "Foo*" and "Foo-Bar"), and scoping and
+    # saving one policy twice would duplicate its scope entries and
+    # race two PUTs of it; so keep only the first match of each.
+    policies = []
+    policy_ids = set()
+    for policy in tools.search_for_objects(
+            JSSConnection.search_method("Policy"), args.policy):
+        if policy.id not in policy_ids:
+            policy_ids.add(policy.id)
+            policies.append(policy)
+    for policy in policies:
+        for group in groups:
+            policy.add_object_to_scope(group)
+
+    # Each save is an independent PUT, so overlap them. Report every
+    # policy's outcome rather than stopping at the first failure, since
+    # the other saves go ahead regardless.
+    failed = False
+    with ThreadPoolExecutor(
+            max_workers=tools.get_max_workers()) as executor:
+        futures = {executor.submit(policy.save): policy
+                   for policy in policies}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except jss.exceptions.PutError as error:
+                failed = True
+                print("%s: Failed. %s" % (futures[future].name, error))
+            else:
+                print("%s: Success." % futures[future].name)
+
+    if failed:
+        sys.exit(1)
 
 
 def computer_group_search_or_modify(args):
@@ -496,9 +811,8 @@ def computer_group_search_or_modify(args):
                 remove.
             dry_run: Bool whether to save or just print group XML.
     """
-    jss_connection = JSSConnection.get()
-    group_search_method = jss_connection.ComputerGroup
-    member_search_method = jss_connection.Computer
+    group_search_method = JSSConnection.search_method("ComputerGroup")
+    member_search_method = JSSConnection.search_method("Computer")
     _group_search_or_modify(group_search_method, member_search_method, args)
 
 
@@ -513,9 +827,8 @@ def md_group_search_or_modify(args):
                 remove.
             dry_run: Bool whether to save or just print group XML.
     """
-    jss_connection = JSSConnection.get()
-    group_search_method = jss_connection.MobileDeviceGroup
-    member_search_method = jss_connection.MobileDevice
+    group_search_method = JSSConnection.search_method("MobileDeviceGroup")
+    member_search_method = JSSConnection.search_method("MobileDevice")
     _group_search_or_modify(group_search_method, member_search_method, args)
 
 
@@ -572,7 +885,7 @@ def get_excluded(args):
         args: argparser args with properties:
             group: Name or ID of computer group.
     """
-    group = JSSConnection.get().ComputerGroup(args.group)
+    group = _resolve("ComputerGroup", args.group)
     _get_exclusions_by_type(group)
 
 
@@ -583,7 +896,7 @@ def get_md_excluded(args):
         args: argparser args with properties:
             group: Name or ID of mobile device group.
     """
-    group = JSSConnection.get().MobileDeviceGroup(args.group)
+    group = _resolve("MobileDeviceGroup", args.group)
     _get_exclusions_by_type(group)
 
 
@@ -595,29 +908,17 @@ def _get_exclusions_by_type(group):
     Args:
         group: A jss.ComputerGroup or jss.MobileDeviceGroup object.
     """
-    jss_connection = JSSConnection.get()
-    scopables = []
     header = " with %s excluded from scope." % group.name
-    base_search = "scope/exclusions/%s_groups/%s_group"
-
-    if isinstance(group, jss.ComputerGroup):
-        search = base_search % ("computer", "computer")
-        scopables.append({"containers": jss_connection.Policy(),
-                          "heading": "Policies"})
-        scopables.append(
-            {"containers": jss_connection.OSXConfigurationProfile(),
-             "heading": "Configuration Profiles"})
-    elif isinstance(group, jss.MobileDeviceGroup):
-        search = base_search % ("mobile_device", "mobile_device")
-        scopables.append(
-            {"containers": jss_connection.MobileDeviceConfigurationProfile(),
-             "heading": "Mobile Device Configuration Profiles"})
-
-    for item in scopables:
-        results = tools.find_objects_in_containers(group, search,
-                                                   item["containers"])
-        output = tools.build_results_string(item["heading"] + header, results)
-        print(output)
+    search, scopables = _EXCLUSION_SEARCHES[type(group)]
+
+    # The listings don't depend on one another, so fetch them together.
+    listings = JSSConnection.batch((obj_type,) for obj_type, _ in scopables)
+    for (_, heading), containers in zip(scopables, listings):
+        # Exclusions live in the scope, so skip retrieving the rest.
+        results = tools.find_objects_in_containers(
+            group, search, containers, subset=tools.SCOPE_SUBSET)
+        tools.write_results(sys.stdout, heading + header, results)
+        sys.stdout.write("\n")
 
 
 def get_package_policies(args):
@@ -627,24 +928,30 @@ def get_package_policies(args):
         args: argparser args with properties:
             package: ID, name, or wildcard-search-name of package.
     """
-    search = "package_configuration/packages/package"
-    jss_connection = JSSConnection.get()
-    policies = jss_connection.Policy()
-    packages = tools.search_for_object(jss_connection.Package, args.package)
-
-    # results = set(found_objects)
-    results = found_objects = tools.find_objects_in_containers(
-        packages, search, policies)
-    output = tools.build_results_string("Policies which install '%s'" %
-                                        args.package, results) + "\n"
-
-    search = "packages/package"
-    imaging_configs = jss_connection.ComputerConfiguration()
-    ic_results = tools.find_objects_in_containers(packages, search,
-                                                      imaging_configs)
-    output += tools.build_results_string("Imaging configs which install '%s'" %
-                                         args.package, ic_results)
-    print(output)
+    packages = tools.search_for_object(
+        JSSConnection.search_method("Package"), args.package)
+
+    # Nothing can match if no packages were found, so don't retrieve
+    # every policy and imaging config just to compare against nothing.
+    if packages:
+        results = tools.find_objects_in_containers(
+            packages, tools.POLICY_PACKAGES_PATH,
+            JSSConnection.listing("Policy"))
+    else:
+        results = []
+    tools.write_results(sys.stdout, "Policies which install '%s'" %
+                        args.package, results)
+    sys.stdout.write("\n")
+
+    if packages:
+        ic_results = tools.find_objects_in_containers(
+            packages, tools.CONFIGURATION_PACKAGES_PATH,
+            JSSConnection.listing("ComputerConfiguration"))
+    else:
+        ic_results = []
+    tools.write_results(sys.stdout, "Imaging configs which install '%s'" %
+                        args.package, ic_results)
+    sys.stdout.write("\n")
 
 
 def promote(args):
@@ -668,13 +975,15 @@ def promote(args):
                 and version number for this to do anything.
     """
     jss_connection = JSSConnection.get()
-    all_packages = jss_connection.Package()
+    all_packages = JSSConnection.listing("Package")
 
     # Handle policy arguments.
     if args.policy:
         policy = jss_connection.Policy(args.policy)
     else:
-        policy_name = tools.policy_menu(jss_connection.Policy(),
+        # The menu only retrieves part of each policy, so get the whole
+        # of the chosen one to modify and save.
+        policy_name = tools.policy_menu(JSSConnection.listing("Policy"),
                                         all_packages)
         policy = jss_connection.Policy(policy_name)
 
@@ -686,9 +995,20 @@ def promote(args):
     else:
         new_pkg_name = tools.get_pkg_menu(all_packages, cur_pkg)
 
+    if new_pkg_name == cur_pkg:
+        print("%s already installs %s; nothing to do." % (policy.name,
+                                                          cur_pkg))
+        return
+
     # Make changes to policy.
     policy.remove_object_from_list(cur_pkg, "package_configuration/packages")
-    policy.add_package(jss_connection.Package(new_pkg_name))
+    # Adding a package only needs its id and name, which the cached
+    # listing already has; only fetch it if it isn't listed by name.
+    new_pkg = next((package for package in all_packages
+                    if package.name == new_pkg_name), None)
+    if new_pkg is None:
+        new_pkg = _resolve("Package", new_pkg_name)
+    policy.add_package(new_pkg)
 
     # Handle policy name updating.
     if args.update_name:
@@ -699,5 +1019,5 @@ def promote(args):
 
     # Save policy and remind user to flush logs if needed.
     policy.save()
-    url = JSSConnection.get().base_url
+    url = jss_connection.base_url
     tools.log_warning(url, policy)
@@ -22,20 +22,223 @@ Class for managing a JSS connection.
 
 from __future__ import absolute_import
 
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import hashlib
+import json
+import os
 import os.path
 import sys
+import threading
+import time
 
 if os.path.isdir('/Library/AutoPkg/JSSImporter'):
-    sys.path.insert(0, '/Library/AutoPkg/JSSImporter')
+    if '/Library/AutoPkg/JSSImporter' not in sys.path:
+        sys.path.insert(0, '/Library/AutoPkg/JSSImporter')
     import jss
 else:
     raise Exception('python-jss is not installed!')
 
+import requests
+from urllib3.util.retry import Retry
+
+from . import tools
+
+
+# Saved responses unused for this many seconds are deleted.
+CACHE_MAX_AGE = 7 * 24 * 60 * 60
+_cache_dir = None
+
+
+def get_cache_dir():
+    """Return the directory to keep GET responses in between runs.
+
+    Uses the value given to set_cache_dir(), then the
+    JSS_HELPER_CACHE_DIR environment variable. Responses are only kept
+    on disk when one of them is set.
+
+    Returns:
+        String path, or None for no disk cache.
+    """
+    if _cache_dir is not None:
+        return _cache_dir
+    cache_dir = os.environ.get("JSS_HELPER_CACHE_DIR")
+    return os.path.expanduser(cache_dir) if cache_dir else None
+
+
+def set_cache_dir(cache_dir):
+    """Set the directory to keep GET responses in between runs.
+
+    Call before the JSS connection is first used.
+
+    Args:
+        cache_dir: String path, or None to use the default.
+    """
+    global _cache_dir
+    _cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
+
+
+@functools.lru_cache(maxsize=1)
+def _default_prefs():
+    """Return python-jss's own preferences, parsed only once.
+
+    Call _default_prefs.cache_clear() to read them again.
+    """
+    return jss.JSSPrefs()
+
+
+class CachingSession(requests.Session):
+    """A requests.Session which remembers successful GET responses.
+
+    A run often asks for the same object more than once (e.g. a group
+    that is both searched for and scoped), so repeat GETs are answered
+    from memory. Any other request (PUT, POST or DELETE) may change
+    what the JSS would return, so it forgets everything.
+
+    Given a cache_dir, responses which carry an ETag are also kept on
+    disk, and later runs ask for them again with If-None-Match; on a
+    304 the saved body is used instead of downloading it again. The
+    server always has the final say, so nothing stale is ever used,
+    and servers which send no ETag simply aren't cached on disk.
+    Saved responses unused for CACHE_MAX_AGE are deleted.
+    """
+
+    def __init__(self, cache_dir=None):
+        super(CachingSession, self).__init__()
+        self._responses = {}
+        self._cache_dir = None
+        if cache_dir:
+            try:
+                self._prepare_cache_dir(cache_dir)
+            except OSError:
+                # The disk cache is only an optimization.
+                return
+            self._cache_dir = cache_dir
+
+    def request(self, method, url, *args, **kwargs):
+        """Make a request, or return the response to an identical GET."""
+        if method.upper() != "GET":
+            self.clear_cache()
+            return super(CachingSession, self).request(
+                method, url, *args, **kwargs)
+
+        # Keep the raw response, not a parsed tree: python-jss adopts
+        # the tree it parses as an object's data, so each caller needs
+        # its own.
+        key = (url, repr(args), repr(sorted(kwargs.items())))
+        response = self._responses.get(key)
+        if response is None:
+            response = self._revalidate(method, url, key, *args, **kwargs)
+            if response.status_code == 200:
+                self._responses[key] = response
+        return response
+
+    def clear_cache(self):
+        """Forget all remembered responses.
+
+        Responses saved on disk are kept; they are always revalidated
+        before use.
+        """
+        self._responses = {}
+
+    def _revalidate(self, method, url, key, *args, **kwargs):
+        """GET url, conditionally if a saved response exists."""
+        if not self._cache_dir:
+            return super(CachingSession, self).request(
+                method, url, *args, **kwargs)
+
+        path = os.path.join(
+            self._cache_dir,
+            hashlib.sha256(repr(key).encode("utf-8")).hexdigest())
+        saved = self._read_saved(path)
+        if saved:
+            headers = dict(kwargs.get("headers") or {})
+            headers["If-None-Match"] = saved[0]["etag"]
+            kwargs["headers"] = headers
+        response = super(CachingSession, self).request(
+            method, url, *args, **kwargs)
+
+        if response.status_code == 304 and saved:
+            # Unchanged; stand the saved response in for the empty one.
+            response.status_code = 200
+            response.headers["Content-Type"] = saved[0]["content_type"]
+            response._content = saved[1]
+            try:
+                # Mark it as used, so that pruning keeps it.
+                os.utime(path)
+            except OSError:
+                pass
+        elif response.status_code == 200 and response.headers.get("ETag"):
+            self._save(path, response)
+        return response
+
+    @staticmethod
+    def _prepare_cache_dir(cache_dir):
+        """Create cache_dir, make sure it is private, and prune it.
+
+        Raises:
+            OSError if the directory can't be created, belongs to
+            another user, or can't be made private.
+        """
+        # API data isn't for other users' eyes, and the saved bodies
+        # are trusted once the server accepts their ETag; so the
+        # directory must be ours alone. makedirs() only applies mode
+        # to a directory it creates.
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        stat_result = os.stat(cache_dir)
+        if stat_result.st_uid != os.getuid():
+            raise OSError("%s belongs to another user." % cache_dir)
+        if stat_result.st_mode & 0o077:
+            os.chmod(cache_dir, 0o700)
+
+        expired = time.time() - CACHE_MAX_AGE
+        for entry in os.scandir(cache_dir):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < expired:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _read_saved(path):
+        """Return a saved response's (metadata, body), or None.
+
+        Anything unreadable or malformed is treated as not saved.
+        """
+        try:
+            with open(path, "rb") as saved_file:
+                metadata = json.loads(saved_file.readline().decode("utf-8"))
+                body = saved_file.read()
+        except (OSError, ValueError):
+            return None
+        if not (isinstance(metadata, dict) and
+                isinstance(metadata.get("etag"), str) and
+                isinstance(metadata.get("content_type"), str)):
+            return None
+        return metadata, body
+
+    def _save(self, path, response):
+        """Save a response's ETag, content type and body to path."""
+        metadata = {"etag": response.headers["ETag"],
+                    "content_type": response.headers.get("Content-Type", "")}
+        try:
+            # The files are created private by write_atomically().
+            tools.write_atomically(
+                path,
+                json.dumps(metadata).encode("utf-8") + b"\n" +
+                response.content)
+        except OSError:
+            # The disk cache is only an optimization.
+            pass
+
 
 class JSSConnection(object):
     """Class for providing a single JSS connection."""
     _jss_prefs = None
     _jss = None
+    _listings = {}
+    # Serializes setup() and the creation of the JSS object.
+    _lock = threading.Lock()
 
     @classmethod
     def setup(cls, connection=None):
@@ -61,13 +264,25 @@ class JSSConnection(object):
         # cls._jss_prefs = jss.JSSPrefs()
         # cls._jss = jss.JSS(jss_prefs=cls._jss_prefs)
 
-        if not connection:
-            connection = {"jss_prefs": jss.JSSPrefs()}
-        cls._jss_prefs = connection
-        if isinstance(connection, jss.JSSPrefs):
-            cls._jss = jss.JSS(jss_prefs=cls._jss_prefs)
-        else:
-            cls._jss = jss.JSS(**cls._jss_prefs)
+        # No connection means python-jss's own preferences, which are
+        # only read once they're needed; see _connect().
+        connection = connection or None
+        with cls._lock:
+            # Listings and responses may be stale, so drop them
+            # regardless.
+            cls._listings = {}
+            if cls._jss is not None and connection == cls._jss_prefs:
+                # Same server and credentials: keep the existing
+                # session, and with it the pooled connections and their
+                # completed TLS handshakes.
+                if isinstance(cls._jss.session, CachingSession):
+                    cls._jss.session.clear_cache()
+                return
+            # Only record the settings; the JSS object (which may make
+            # requests of its own when it is created) is built by the
+            # first get().
+            cls._jss = None
+            cls._jss_prefs = connection
 
         # if args:
         #     args_dict = vars(args)
@@ -79,9 +294,159 @@ class JSSConnection(object):
 
 
 
+    @staticmethod
+    def _configure_session(session):
+        """Pool enough connections for concurrent requests, and retry.
+
+        python-jss makes every request through one requests.Session,
+        so connections are already kept alive. Its default pool only
+        holds 10 per host, though; with more concurrent requests than
+        that, extra connections are closed after use and each
+        replacement pays for a new TCP and TLS handshake.
+
+        requests only speaks HTTP/1.1, so a connection carries one
+        request at a time; concurrent requests are overlapped by giving
+        each worker (see tools.get_max_workers()) its own pooled
+        connection instead.
+
+        Args:
+            session: The jss.JSS object's session. Sessions other than
+                a requests.Session (e.g. a CurlAdapter) are left alone.
+        """
+        if not isinstance(session, requests.Session):
+            return
+        # Ride out dropped connections and a briefly overloaded server
+        # rather than failing a whole run part way through. Retry only
+        # urllib3's default idempotent methods, so a POST is never sent
+        # twice. The final response is still handed to python-jss to
+        # report.
+        retries = Retry(total=3, backoff_factor=0.3,
+                        status_forcelist=(502, 503, 504),
+                        raise_on_status=False)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=tools.get_max_workers(), max_retries=retries)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        # API XML is verbose and compresses well. requests asks for
+        # compressed responses by default; make sure of it, as
+        # python-jss's per-request headers are merged over these.
+        # (Responses stay XML: python-jss objects are XML elements, and
+        # it sends its own Accept header for the Classic API.)
+        session.headers["Accept-Encoding"] = "gzip, deflate"
+
     @classmethod
     def get(cls):
-        """Return the shared JSS object."""
-        if not cls._jss:
-            cls.setup()
-        return cls._jss
+        """Return the shared JSS object, creating it if needed.
+
+        Safe to call from worker threads; the JSS object is only ever
+        created once per setup().
+        """
+        # Once created, this is a single attribute read; only the first
+        # callers ever touch the lock.
+        jss_connection = cls._jss
+        if jss_connection is None:
+            with cls._lock:
+                # Another thread may have connected while we waited.
+                if cls._jss is None:
+                    cls._jss = cls._connect(cls._jss_prefs)
+                jss_connection = cls._jss
+        return jss_connection
+
+    @classmethod
+    def _connect(cls, connection):
+        """Return a new, configured jss.JSS for connection settings."""
+        if not connection:
+            connection = {"jss_prefs": _default_prefs()}
+        if isinstance(connection, jss.JSSPrefs):
+            jss_connection = jss.JSS(
+                jss_prefs=connection, adapter=CachingSession(get_cache_dir()))
+        else:
+            kwargs = dict(connection)
+            # Respect a network adapter chosen by the caller.
+            kwargs.setdefault("adapter", CachingSession(get_cache_dir()))
+            jss_connection = jss.JSS(**kwargs)
+        cls._configure_session(jss_connection.session)
+        return jss_connection
+
+    @classmethod
+    def listing(cls, obj_type):
+        """Return a listing of all objects of a type.
+
+        The list GET is made at most once per connection. Each call
+        returns new, unretrieved objects built from the cached listing,
+        so callers may retrieve (or subset) and modify them without
+        affecting one another.
+
+        Args:
+            obj_type: String name of a jss.JSS search method (e.g.
+                "Policy").
+
+        Returns:
+            jss.QuerySet of objects of obj_type.
+        """
+        jss_connection = cls.get()
+        if obj_type not in cls._listings:
+            cls._listings[obj_type] = getattr(jss_connection, obj_type)()
+        # QuerySets sort themselves by ID on construction. The cached
+        # listing already is, so extend an empty one to keep its order
+        # rather than sorting again on every call.
+        listing = jss.QuerySet([])
+        listing.extend(obj.__class__(jss_connection, obj.basic)
+                       for obj in cls._listings[obj_type])
+        return listing
+
+    @classmethod
+    def search_method(cls, obj_type):
+        """Return a jss.JSS search method which lists from the cache.
+
+        Called with no arguments, the returned function gives the
+        cached listing (see listing()); otherwise it searches the JSS,
+        as the jss.JSS method does. Pass it wherever a search method is
+        expected, so that listing the same type twice costs one GET.
+
+        Args:
+            obj_type: String name of a jss.JSS search method (e.g.
+                "Policy").
+
+        Returns:
+            A function with the same signature as the jss.JSS method.
+        """
+        def search(*args, **kwargs):
+            """Search the JSS, or list all objects from the cache."""
+            if not args and not kwargs:
+                return cls.listing(obj_type)
+            return getattr(cls.get(), obj_type)(*args, **kwargs)
+
+        return search
+
+    @classmethod
+    def batch(cls, calls):
+        """Make independent JSS calls concurrently.
+
+        Calls go out together over the shared session's connection
+        pool, so N lookups take about as long as the slowest rather
+        than the sum of them all.
+
+        Calls without arguments are listings, and are answered from
+        the listing cache as by search_method().
+
+        Args:
+            calls: Iterable of tuples of a jss.JSS method name followed
+                by its arguments, e.g. (("Policy", 12), ("Package",)).
+
+        Returns:
+            List of the calls' results, in the order of calls.
+
+        Raises:
+            The first exception raised by any call, once all have
+            finished.
+        """
+        # Connect before the workers start, rather than in all of them.
+        cls.get()
+        calls = list(calls)
+        if not calls:
+            return []
+        with ThreadPoolExecutor(
+                max_workers=min(len(calls), tools.get_max_workers())) as executor:
+            return list(executor.map(
+                lambda call: cls.search_method(call[0])(*call[1:]), calls))
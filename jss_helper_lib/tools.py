@@ -23,22 +23,24 @@ Support functions for jss_helper.
 
 from __future__ import absolute_import
 from __future__ import print_function
-from distutils.version import StrictVersion
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import difflib
 
 # from packaging.version import parse as LooseVersion
 import fnmatch
+import functools
+import io
 from operator import itemgetter
 import os.path
 import re
 import subprocess
 import sys
-from six.moves.urllib.parse import quote
-from six.moves import range
-from six.moves import zip
-from six.moves import input
+import tempfile
 
 if os.path.isdir("/Library/AutoPkg"):
-    sys.path.insert(0, "/Library/AutoPkg")
+    if "/Library/AutoPkg" not in sys.path:
+        sys.path.insert(0, "/Library/AutoPkg")
     try:
         from autopkglib import APLooseVersion as LooseVersion
     except ModuleNotFoundError:
@@ -51,17 +53,58 @@ else:
     raise Exception("ERROR! AutoPkg is not installed!")
 
 
-REQUIRED_PYTHON_JSS_VERSION = StrictVersion("2.1.0")
+REQUIRED_PYTHON_JSS_VERSION = LooseVersion("2.1.0")
 WILDCARDS = "*?[]"
+_WILDCARD_SET = frozenset(WILDCARDS)
+# Product name should be a combination of letters, numbers,
+# hyphens, or underscores.
+# A " ", "-", or "_" should separate the name from the version.
+# whitespace, hyphens, or underscores
+# The version then is any number of digits, followed by any number
+# of letters, numbers, separated by "-", "_", "."s.
+# Finally, an extension of ".pkg", ".pkg.zip", or ".dmg" must
+# follow.
+PACKAGE_REGEX = re.compile(
+    r"^(?P<basename>[\w\s\-]+)[\s\-_]"
+    r"(?P<version>[\d]+[\w.\-]*)"
+    r"(?P<extension>\.(pkg(\.zip)?|dmg))$"
+)
+# Concurrent requests used when retrieving many objects. Override with
+# the JSS_MAX_WORKERS environment variable for servers that throttle.
+DEFAULT_MAX_WORKERS = 16
+_max_workers = None
+# Paths to package references, for find_objects_in_containers().
+POLICY_PACKAGES_PATH = "package_configuration/packages/package"
+CONFIGURATION_PACKAGES_PATH = "packages/package"
+# Policy subsets read by policy_menu(); Jamf names them in CamelCase.
+POLICY_MENU_SUBSET = ("general", "PackageConfiguration")
+# Policy triggers which mean it may have already run; see log_warning().
+POLICY_TRIGGERS = frozenset((
+    "trigger_checkin",
+    "trigger_enrollment_complete",
+    "trigger_login",
+    "trigger_logout",
+    "trigger_network_state_changed",
+    "trigger_startup",
+    "trigger_other",
+))
+# Subsets holding everything scope searches read.
+SCOPE_SUBSET = ("general", "scope")
+# Path of the static member list in each type of group.
+GROUP_MEMBER_PATHS = {jss.ComputerGroup: "computers",
+                      jss.MobileDeviceGroup: "mobile_devices"}
+# Object types scoped to computers, and to mobile devices.
+_COMPUTER_SCOPABLES = (jss.Policy, jss.OSXConfigurationProfile)
+_MOBILE_DEVICE_SCOPABLES = (jss.MobileDeviceConfigurationProfile,)
 
 
 # General Functions
 def version_check():
     """Ensure we have the right version of python-jss."""
     try:
-        python_jss_version = StrictVersion(jss.__version__)
+        python_jss_version = LooseVersion(jss.__version__)
     except AttributeError:
-        python_jss_version = StrictVersion("0.0.0")
+        python_jss_version = LooseVersion("0.0.0")
 
     if python_jss_version < REQUIRED_PYTHON_JSS_VERSION:
         print(
@@ -73,6 +116,99 @@ def version_check():
     return python_jss_version
 
 
+def get_max_workers():
+    """Return the number of concurrent requests to make to the JSS.
+
+    Uses the value given to set_max_workers(), then the JSS_MAX_WORKERS
+    environment variable, then DEFAULT_MAX_WORKERS.
+    """
+    if _max_workers is not None:
+        return _max_workers
+    try:
+        workers = int(os.environ.get("JSS_MAX_WORKERS", DEFAULT_MAX_WORKERS))
+    except ValueError:
+        workers = DEFAULT_MAX_WORKERS
+    return max(workers, 1)
+
+
+def set_max_workers(workers):
+    """Set the number of concurrent requests to make to the JSS.
+
+    Call before the JSS connection is first used, as its connection
+    pool is sized from get_max_workers().
+
+    Args:
+        workers: Int number of requests, or None to use the default.
+    """
+    global _max_workers
+    _max_workers = None if workers is None else max(int(workers), 1)
+
+
+def retrieve_all_parallel(containers, workers=None, subset=None):
+    """Retrieve the full data of many JSSObjects concurrently.
+
+    A drop-in for jss.QuerySet.retrieve_all(). Retrieval time is
+    dominated by HTTP round trips, so the requests are overlapped on a
+    thread pool rather than made one at a time.
+
+    Args:
+        containers: A jss.QuerySet or list of JSSObjects.
+        workers: Number of concurrent requests. Defaults to
+            get_max_workers().
+        subset: Optional list of the top level subelements to retrieve
+            (e.g. ["general", "scope"]), for object types which allow
+            subset queries. Objects retrieved with a subset only hold
+            part of their data, so don't save them.
+
+    Returns:
+        containers, with all of its objects retrieved.
+    """
+    for _ in iter_retrieved(containers, workers, subset):
+        pass
+    return containers
+
+
+def iter_retrieved(containers, workers=None, subset=None):
+    """Yield JSSObjects in order, each as soon as it is retrieved.
+
+    Like retrieve_all_parallel(), but lets the caller work on the first
+    objects while the rest are still being fetched.
+
+    Args:
+        containers: A jss.QuerySet or list of JSSObjects.
+        workers: Number of concurrent requests. Defaults to
+            get_max_workers().
+        subset: Optional list of the top level subelements to
+            retrieve; see retrieve_all_parallel().
+
+    Yields:
+        Each JSSObject of containers, retrieved.
+    """
+    stale = [obj for obj in containers if not obj.cached]
+    if not stale:
+        for obj in containers:
+            yield obj
+        return
+    if subset:
+        for obj in stale:
+            if "subset" in getattr(obj, "allowed_kwargs", ()):
+                # python-jss may append to the list, so give each its own.
+                obj.kwargs["subset"] = list(subset)
+
+    def retrieve(obj):
+        """Retrieve obj if needed, and return it."""
+        if not obj.cached:
+            obj.retrieve()
+        return obj
+
+    with ThreadPoolExecutor(
+            max_workers=workers or get_max_workers()) as executor:
+        # map() submits every request up front, but hands back results
+        # in order, raising any error when its object is reached.
+        for obj in executor.map(retrieve, containers):
+            yield obj
+
+
 def build_results_string(heading, results):
     """Format results for output reporting.
 
@@ -84,32 +220,59 @@ def build_results_string(heading, results):
     Returns:
         Formatted report string.
     """
-    output_string = ""
+    output = io.StringIO()
+    write_results(output, heading, results)
+    return output.getvalue()
+
+
+def write_results(stream, heading, results):
+    """Write results, formatted for output reporting, to a stream.
+
+    Args:
+        stream: A file-like object with a write() method; e.g.
+            sys.stdout or an io.StringIO.
+        heading: String heading for results, or None for no heading.
+        results: An iterable of JSSObjects, a JSSObjectList, or a
+            single JSSObject.
+    """
     if heading:
-        output_string = heading
-        if not output_string.endswith("\n"):
-            output_string += "\n"
+        stream.write(heading)
+        if not heading.endswith("\n"):
+            stream.write("\n")
+    # The first result is looked at below, so don't let that use up an
+    # iterator's first item.
+    if results is not None and not isinstance(
+        results, (jss.JSSObject, list, tuple)
+    ):
+        results = list(results)
     # Print column aligned lists of ID and Name.
     if results:
-        if all([isinstance(result, jss.JSSObject) for result in results]) or (
-            isinstance(results, jss.JSSObjectList) and len(results) > 0
+        # Results come from a single search or listing, so one
+        # object's type speaks for them all. (A lone JSSObject is an
+        # Element; its first item is a child element.)
+        if not isinstance(results, jss.JSSObject) and isinstance(
+            next(iter(results)), jss.JSSObject
         ):
-            width = max([int(len(str(result.id))) for result in results])
-            output_strings = []
-            for i in results:
-                output_strings.append(
-                    u"ID: {:>{width}}\tNAME: {}".format(i.id, i.name, width=width)
-                )
-            output_string += "\n".join(output_strings)
+            # Gather each ID and name, and the ID column's width, in a
+            # single pass.
+            rows = []
+            width = 0
+            for result in results:
+                obj_id = str(result.id)
+                rows.append((obj_id, result.name))
+                width = max(width, len(obj_id))
+            stream.write("\n".join(
+                u"ID: {:>{width}}\tNAME: {}".format(obj_id, name, width=width)
+                for obj_id, name in rows))
         # Just print the object.
         elif isinstance(results, jss.JSSObject):
-            output_string += str(results)
+            stream.write(str(results))
     else:
-        output_string += "No results found."
-    return output_string + "\n"
+        stream.write("No results found.")
+    stream.write("\n")
 
 
-def search_for_object(obj_method, search):
+def search_for_object(obj_method, search, listing=None):
     """Return objects matching a search pattern.
 
     Manages making the appropriate searches based on the type of
@@ -123,24 +286,37 @@ def search_for_object(obj_method, search):
             "jss_connection.Package"
         search: A name, ID, or wildcard search (see func
             wildcard_search). Used as the argument to "obj_method".
+            Integers and all-decimal strings are treated as IDs.
+        listing: Optional result of calling "obj_method" with no
+            arguments, to match wildcard searches against instead of
+            fetching a new listing.
 
     Returns:
         A list of JSSObjects, or a JSSObjectList
     """
-    search_is_wildcard = False
-    if search:
-        for wildcard in WILDCARDS:
-            if wildcard in search:
-                search_is_wildcard = True
+    if isinstance(search, str) and search.isdecimal():
+        # Not every caller parses its arguments with a type; an
+        # all-digit search is an ID, which can't contain wildcards.
+        search = int(search)
+    if isinstance(search, int):
+        try:
+            return [obj_method(search)]
+        except jss.GetError:
+            return []
 
     results = []
-    if search_is_wildcard:
-        wildcard_results = wildcard_search(obj_method(), search)
-        for obj in wildcard_results:
-            try:
-                results.append(obj_method(obj.name))
-            except jss.GetError:
-                continue
+    if is_wildcard(search):
+        if listing is None:
+            listing = obj_method()
+        wildcard_results = wildcard_search(listing, search)
+        if wildcard_results:
+            # Retrieve the matches themselves, all at once, rather than
+            # looking each one up again by name.
+            with ThreadPoolExecutor(max_workers=min(
+                    len(wildcard_results), get_max_workers())) as executor:
+                results = [obj for obj in
+                           executor.map(_retrieve_or_none, wildcard_results)
+                           if obj is not None]
     else:
         if search:
             try:
@@ -156,6 +332,45 @@ def search_for_object(obj_method, search):
     return results
 
 
+def _retrieve_or_none(obj):
+    """Retrieve obj if needed, and return it, or None if it's gone."""
+    if not obj.cached:
+        try:
+            obj.retrieve()
+        except jss.GetError:
+            return None
+    return obj
+
+
+def search_for_objects(obj_method, searches):
+    """Return objects matching any of a list of search patterns.
+
+    Wildcard searches all match against a single listing from
+    "obj_method", fetched only if one of the searches needs it.
+
+    Args:
+        obj_method: Func to call to perform the search, as for
+            search_for_object.
+        searches: Iterable of names, IDs, or wildcard searches.
+
+    Returns:
+        A list of JSSObjects.
+    """
+    listing = None
+    results = []
+    for search in searches:
+        if isinstance(search, str) and is_wildcard(search):
+            if listing is None:
+                listing = obj_method()
+        results.extend(search_for_object(obj_method, search, listing))
+    return results
+
+
+def is_wildcard(search):
+    """Return whether a search string contains any wildcards."""
+    return bool(search) and not _WILDCARD_SET.isdisjoint(search)
+
+
 def wildcard_search(objects, pattern, case_sensitive=True):
     """Search for names that match a Unix-shell style pattern.
 
@@ -177,21 +392,15 @@ def wildcard_search(objects, pattern, case_sensitive=True):
     """
     # The fnmatch module uses OS-specific case sensitivity settings.
     # We are not matching filenames, so we don't care what the
-    # filesystem wants.
-
-    # It would probably be easier to just copy the fnmatch source here
-    # and edit fnmatch.fnmatch to do what we need!
-    if not case_sensitive:
-        test_names = [(obj, obj.name.upper()) for obj in objects]
-    else:
-        test_names = [(obj, obj.name) for obj in objects]
-
-    results = [obj for obj, name in test_names if fnmatch.fnmatchcase(name, pattern)]
-
-    return results
+    # filesystem wants; translate the pattern to a regex ourselves,
+    # once, and match every name against it.
+    flags = 0 if case_sensitive else re.IGNORECASE
+    match = re.compile(fnmatch.translate(pattern), flags).match
+    return [obj for obj in objects if match(obj.name)]
 
 
-def find_objects_in_containers(search_objects, search_path, containers):
+def find_objects_in_containers(search_objects, search_path, containers,
+                               subset=None):
     """Get all container objects which contain references to objects.
 
     JSS Objects often reference other objects: e.g. Policies have
@@ -205,30 +414,62 @@ def find_objects_in_containers(search_objects, search_path, containers):
             'containers' to search within.
         containers: List of JSSObjects in which to locate
             'search_objects'.
+        subset: Optional list of the top level subelements to retrieve
+            for unretrieved containers; see retrieve_all_parallel(). It
+            must include the start of search_path.
 
     Returns: A list of JSSObjects which match.
     """
     results = []
-    if isinstance(containers, jss.JSSObjectList):
-        full_objects = containers.retrieve_all()
+    if isinstance(search_objects, jss.JSSObject):
+        search_objects = [search_objects]
+    # Hash the references to look for, so each membership test is
+    # constant time however many search_objects there are. Empty
+    # references (text of None) never match.
+    search_ids = {obj.id for obj in search_objects} - {None}
+    search_names = {obj.name for obj in search_objects} - {None}
+    if not (search_ids or search_names):
+        # Nothing can match, so don't retrieve the containers.
+        return results
+
+    if isinstance(containers, jss.QuerySet) or all(
+            isinstance(obj, jss.JSSObject) for obj in containers):
+        # Fetch any unretrieved containers concurrently (plain lists
+        # included), and search each as it arrives rather than waiting
+        # for all of them.
+        full_objects = iter_retrieved(containers, subset=subset)
     else:
         full_objects = containers
 
-    if isinstance(search_objects, jss.JSSObject):
-        search_objects = [search_objects]
-    search_ids = [obj.id for obj in search_objects]
-    search_names = [obj.name for obj in search_objects]
+    # Track matches by identity; JSSObject equality serializes the XML
+    # of both objects for every comparison.
+    matched = set()
     for obj in full_objects:
-        for element in obj.findall(search_path):
-            search_id = element.findtext("id")
-            search_name = element.findtext("name")
-            if (
-                search_id in search_ids or search_name in search_names
-            ) and obj not in results:
+        if id(obj) in matched:
+            continue
+        for element in obj.iterfind(search_path):
+            # One matching reference is enough; skip the rest.
+            if _is_reference_to(element, search_ids, search_names):
+                matched.add(id(obj))
                 results.append(obj)
+                break
     return results
 
 
+def _is_reference_to(element, search_ids, search_names):
+    """Return whether a reference element names a searched-for object.
+
+    Reads the reference's id and name from its children directly,
+    rather than evaluating two more paths.
+    """
+    for child in element:
+        if child.tag == "id" and child.text in search_ids:
+            return True
+        if child.tag == "name" and child.text in search_names:
+            return True
+    return False
+
+
 def find_groups_in_scope(groups, scopables):
     """Find groups which are scoped in scopables.
 
@@ -240,16 +481,111 @@ def find_groups_in_scope(groups, scopables):
 
     Returns: A list of JSSObjects which match.
     """
-    if isinstance(scopables, jss.JSSObjectList):
-        scopables = scopables.retrieve_all()
-    if scopables and isinstance(
-        scopables[0], (jss.Policy, jss.OSXConfigurationProfile)
-    ):
-        search = "scope/computer_groups/computer_group"
-    elif scopables and isinstance(scopables[0], jss.MobileDeviceConfigurationProfile):
-        search = "scope/mobile_device_groups/mobile_device_group"
+    return partition_scope(groups, scopables)[0]
+
+
+def partition_scope(groups, scopables):
+    """Find scopables which scope groups, and those scoped to all.
+
+    Both are gathered in the same single pass over scopables, rather
+    than scanning once with find_groups_in_scope() and again with
+    get_scoped_to_all().
+
+    Args:
+        groups: A jss ComputerGroup or MobileDeviceGroup object, or a
+            list of them.
+        scopables: A list of JSSObjects or a jss.QuerySet of some
+            types which have a "scope" subelement (Policy,
+            OSXConfigurationProfile, MobileDeviceConfigurationProfile).
+
+    Returns:
+        Tuple of two lists of JSSObjects: those which scope any of
+        groups, and those scoped to all computers or mobile devices.
+    """
+    if isinstance(scopables, jss.QuerySet):
+        scopables = retrieve_all_parallel(scopables)
+    if isinstance(groups, jss.JSSObject):
+        groups = [groups]
+    by_group, scoped_to_all = index_scope(scopables)
+
+    seen = set()
+    results = []
+    for group in groups:
+        for scopable in get_indexed_scope(by_group, group):
+            if id(scopable) not in seen:
+                seen.add(id(scopable))
+                results.append(scopable)
+    return results, scoped_to_all
+
+
+def index_scope(scopables):
+    """Index scopables by the groups in their scope in a single pass.
+
+    Args:
+        scopables: A list of JSSObjects of a type which has a "scope"
+            subelement (Policy, OSXConfigurationProfile,
+            MobileDeviceConfigurationProfile). Retrieve them first;
+            otherwise each object is fetched as it is inspected.
+
+    Returns:
+        Tuple of (dict, list). The dict maps ("id", ID) and
+        ("name", name) tuples for each scoped group to a list of the
+        scopables which scope it. The list holds the scopables scoped
+        to all computers or mobile devices.
+    """
+    by_group = {}
+    scoped_to_all = []
+    if not scopables:
+        return by_group, scoped_to_all
+
+    if isinstance(scopables[0], jss.MobileDeviceConfigurationProfile):
+        group_search = "mobile_device_groups/mobile_device_group"
+        all_tag = "all_mobile_devices"
+    else:
+        group_search = "computer_groups/computer_group"
+        all_tag = "all_computers"
+
+    for scopable in scopables:
+        # Find the scope once, and search beneath it, rather than
+        # walking down from the root for each path.
+        scope = scopable.find("scope")
+        if scope is None:
+            continue
+        if scope.findtext(all_tag) == "true":
+            scoped_to_all.append(scopable)
+        # Gather id and name text straight off the group references
+        # without building intermediate element lists.
+        keys = set()
+        for element in scope.iterfind(group_search):
+            for child in element:
+                # Keep the tag in the key; a group may be named with
+                # another group's ID.
+                if child.tag in ("id", "name") and child.text:
+                    keys.add((child.tag, child.text))
+        for key in keys:
+            by_group.setdefault(key, []).append(scopable)
+
+    return by_group, scoped_to_all
+
+
+def get_indexed_scope(by_group, group):
+    """Return the scopables which scope a group from a scope index.
+
+    Args:
+        by_group: Dict as returned (first) by index_scope().
+        group: A jss ComputerGroup or MobileDeviceGroup object.
 
-    return find_objects_in_containers(groups, search, scopables)
+    Returns: A list of JSSObjects.
+    """
+    # Compare by identity; JSSObject equality serializes both objects.
+    seen = set()
+    results = []
+    for key in (("id", group.id), ("name", group.name)):
+        for scopable in by_group.get(key, ()):
+            if id(scopable) not in seen:
+                seen.add(id(scopable))
+                results.append(scopable)
+    return results
 
 
 def get_scoped_to_all(containers):
@@ -265,14 +601,21 @@ def get_scoped_to_all(containers):
     if not isinstance(containers, list):
         containers = [containers]
 
+    # Containers are usually all of one type, so only pick the path
+    # again when the type changes.
     results = []
+    container_type = search = None
     for container in containers:
-        if isinstance(container, (jss.Policy, jss.OSXConfigurationProfile)):
-            if container.findtext("scope/all_computers") == "true":
-                results.append(container)
-        elif isinstance(container, (jss.MobileDeviceConfigurationProfile)):
-            if container.findtext("scope/all_mobile_devices") == "true":
-                results.append(container)
+        if type(container) is not container_type:
+            container_type = type(container)
+            if issubclass(container_type, _COMPUTER_SCOPABLES):
+                search = "scope/all_computers"
+            elif issubclass(container_type, _MOBILE_DEVICE_SCOPABLES):
+                search = "scope/all_mobile_devices"
+            else:
+                search = None
+        if search and container.findtext(search) == "true":
+            results.append(container)
     return results
 
 
@@ -309,47 +652,118 @@ def create_search_func(obj_method):
     return search_func
 
 
-def write_text_to_file(ofilename, text):
-    """Write text to a file.
+def write_atomically(path, data):
+    """Replace a file's contents in one step.
 
-    Adds a concluding newline character.
+    Data is written to a temporary file alongside path and renamed over
+    it, so readers (and concurrent runs) never see a partial file.
 
     Args:
-        ofilename: Name of file to create.
-        text: Text to write.
+        path: String path of the file to write.
+        data: String or bytes to write.
+
+    Raises:
+        OSError: The file could not be written.
     """
-    with open(ofilename, mode="w") as ofile:
-        ofile.write(text + "\n")
+    directory = os.path.dirname(os.path.abspath(path))
+    mode = "wb" if isinstance(data, bytes) else "w"
+    with tempfile.NamedTemporaryFile(
+            mode=mode, dir=directory, delete=False) as ofile:
+        temp_path = ofile.name
+        try:
+            ofile.write(data)
+        except Exception:
+            ofile.close()
+            os.remove(temp_path)
+            raise
+    try:
+        os.replace(temp_path, path)
+    except OSError:
+        os.remove(temp_path)
+        raise
 
 
-def diff(text1, text2):
-    """Perform an sdiff comparison of two strings.
+def diff(text1, text2, width=130):
+    """Perform a side-by-side comparison of two strings.
 
-    Due to the limitations of diff, strings must first be written to
-    temporary files.
+    Output follows the format of "sdiff -d", but is computed in
+    process with difflib rather than written out to temp files and
+    handed to an external tool.
 
     Args:
         text1: First body of text.
         text2: Second body of text.
+        width: Int total width of output lines. Defaults to sdiff's
+            130 characters.
 
     Returns:
-        Output from sdiff.
+        String side-by-side diff.
     """
-    output_tuple = list(
-        zip(("/tmp/jss_helper_diff_%s.txt" % num for num in range(2)), (text1, text2))
-    )
-    for filename, text in output_tuple:
-        write_text_to_file(filename, text)
-    # Diff will return 1 if files differ, so we have to catch that
-    # error.
-    try:
-        result = subprocess.check_output(
-            ["sdiff", "-d", output_tuple[0][0], output_tuple[1][0]]
-        )
-    except subprocess.CalledProcessError as err:
-        result = err.output
+    # Expand tabs, as sdiff does, so that padding and truncation work
+    # in display columns and the gutter stays put.
+    lines1 = [line.expandtabs() for line in text1.splitlines()]
+    lines2 = [line.expandtabs() for line in text2.splitlines()]
+    column = (width - 3) // 2
+    output = []
+    matcher = difflib.SequenceMatcher(None, lines1, lines2, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        left = lines1[i1:i2]
+        right = lines2[j1:j2]
+        if tag == "equal":
+            rows = [(line1, " ", line2) for line1, line2 in zip(left, right)]
+        else:
+            # Pair up changed lines, then mark whatever is left over
+            # as only on one side, as sdiff does.
+            paired = min(len(left), len(right))
+            rows = [(line1, "|", line2)
+                    for line1, line2 in zip(left[:paired], right[:paired])]
+            rows.extend((line, "<", "") for line in left[paired:])
+            rows.extend(("", ">", line) for line in right[paired:])
+        output.extend(("%-*s %s %s" % (column, line1[:column], gutter,
+                                       line2[:column])).rstrip()
+                      for line1, gutter, line2 in rows)
+
+    return "\n".join(output)
+
+
+def diff_unified(text1, text2, name1="", name2=""):
+    """Perform a unified diff of two strings.
+
+    Args:
+        text1: First body of text.
+        text2: Second body of text.
+        name1: String label for text1 in the diff header.
+        name2: String label for text2 in the diff header.
+
+    Returns:
+        String unified diff; empty if the texts match.
+    """
+    return "\n".join(difflib.unified_diff(
+        text1.splitlines(), text2.splitlines(), fromfile=name1,
+        tofile=name2, lineterm=""))
 
-    return result
+
+def diff_set(text1, text2):
+    """Find the lines unique to each of two strings, ignoring order.
+
+    A coarse, linear time alternative to diff() for when only which
+    lines were added or removed matters.
+
+    Args:
+        text1: First body of text.
+        text2: Second body of text.
+
+    Returns:
+        Tuple of two lists: the lines only in text1, and the lines
+        only in text2, each in their original order.
+    """
+    lines1 = text1.splitlines()
+    lines2 = text2.splitlines()
+    set1 = set(lines1)
+    set2 = set(lines2)
+    only_in_1 = [line for line in lines1 if line not in set2]
+    only_in_2 = [line for line in lines2 if line not in set1]
+    return only_in_1, only_in_2
 
 
 # Group manipulation functions ###############################################
@@ -362,39 +776,104 @@ def build_group_members(obj_search_method, searches):
         searches: List of searches to perform (with search_for_object).
 
     Returns:
-        List of JSSObjects that match the searches.
+        List of JSSObjects that match the searches. Group membership
+        only needs each device's ID and name, so objects found in a
+        listing are not retrieved.
     """
-    devices = [
-        device
-        for obj_search in searches
-        for device in search_for_object(obj_search_method, obj_search)
-    ]
-    return devices
+    searches = list(searches)
+    if not searches:
+        return []
+    if not any(isinstance(search, str) and is_wildcard(search)
+               for search in searches):
+        # A few exact lookups are cheaper than listing every device.
+        # They're independent, so make them concurrently.
+        with ThreadPoolExecutor(
+                max_workers=min(len(searches), get_max_workers())) as executor:
+            found = executor.map(
+                lambda search: search_for_object(obj_search_method, search),
+                searches)
+            return [obj for objects in found for obj in objects]
+
+    # A wildcard needs the full listing anyway, so resolve the exact
+    # names and IDs from it too, rather than with a request apiece.
+    listing = obj_search_method()
+    by_id = {}
+    by_name = {}
+    for obj in listing:
+        by_id[str(obj.id)] = obj
+        by_name[obj.name] = obj
+
+    results = []
+    for search in searches:
+        if isinstance(search, str) and is_wildcard(search):
+            results.extend(wildcard_search(listing, search))
+            continue
+        search = str(search)
+        obj = by_id.get(search) if search.isdecimal() else by_name.get(search)
+        if obj is not None:
+            results.append(obj)
+    return results
 
 
 def add_group_members(group, members):
-    """Add list of members to computer or md group."""
-    if isinstance(group, jss.ComputerGroup):
-        add_method = group.add_computer
-    elif isinstance(group, jss.MobileDeviceGroup):
-        add_method = group.add_mobile_device
+    """Add list of members to computer or md group.
+
+    Members are appended to the group's own member list; nothing is
+    sent to the JSS until the group is saved.
+
+    Raises:
+        ValueError if group is a smart group, or has no member list.
+    """
+    if not members:
+        return
+    if group.findtext("is_smart") != "false":
+        raise ValueError("Devices may not be added to smart groups.")
+    # Find the member list once, rather than once per member (and
+    # without python-jss's rescan of the list after each append).
+    member_list = _find_member_list(group)
+    if member_list is None:
+        raise ValueError("%s has no member list!" % group.name)
     for member in members:
         print("Adding %s to %s" % (member.name, group.name))
-        add_method(member)
+        member_list.append(member.as_list_data())
 
 
 def remove_group_members(group, members):
     """Remove list of members to computer or md group."""
-    if isinstance(group, jss.ComputerGroup):
-        remove_method = group.remove_computer
-    elif isinstance(group, jss.MobileDeviceGroup):
-        remove_method = group.remove_mobile_device
+    if not members:
+        return
+    member_list = _find_member_list(group)
+    # Index the current members by ID once, so each removal is a
+    # lookup instead of a scan of the whole list.
+    current = {}
+    for item in member_list if member_list is not None else ():
+        current.setdefault(item.findtext("id"), []).append(item)
+    removed = set()
     for member in members:
+        # Overlapping searches may name a member more than once.
+        if member.id in removed:
+            continue
         print("Removing %s from %s" % (member.name, group.name))
-        try:
-            remove_method(member)
-        except ValueError:
+        matches = current.pop(member.id, ())
+        if not matches:
             print("%s is not a member; not removing." % member.name)
+            continue
+        for item in matches:
+            member_list.remove(item)
+        removed.add(member.id)
+
+
+def _find_member_list(group):
+    """Return a group's static member list element, or None.
+
+    Raises:
+        ValueError if group isn't a computer or mobile device group.
+    """
+    for group_class, path in GROUP_MEMBER_PATHS.items():
+        if isinstance(group, group_class):
+            return group.find(path)
+    raise ValueError("%s is not a computer or mobile device group!" %
+                     group.name)
 
 
 # Promotion functions #########################################################
@@ -412,51 +891,98 @@ def get_updatable_policies(policies, packages):
         package that is older than another package available on the
         JSS.
     """
+    return find_updatable(
+        (get_policy_packages(policy) for policy in policies), packages)
+
+
+def get_policy_packages(policy):
+    """Return a policy's name and the names of the packages it installs.
+
+    Args:
+        policy: A Policy object, retrieved with at least its general
+            and package configuration data.
+
+    Returns:
+        Tuple of (string policy name, list of string package names).
+    """
+    packages_element = policy.find("package_configuration/packages")
+    # Most policies install no packages at all.
+    if packages_element is None or packages_element.findtext("size") == "0":
+        package_names = []
+    else:
+        package_names = [
+            element.text for element in packages_element.iterfind("package/name")
+        ]
+    return policy.findtext("general/name"), package_names
+
+
+def find_updatable(policy_packages, packages):
+    """Like get_updatable_policies(), from policies' package names.
+
+    Args:
+        policy_packages: An iterable of (policy name, package names)
+            tuples, as returned by get_policy_packages().
+        packages: A list of Package objects available on the JSS.
+
+    Returns:
+        A list of strings; the names of policies which install a
+        package that is older than another package in packages.
+    """
     multiples = _build_package_version_dict(packages)
 
-    # For each policy, lookup any packages it installs in the multiples
-    # dictionary and see if there is a newer version available.
-    updates_available = []
-    search = "package_configuration/packages/package/name"
-    for policy in policies:
-        packages_installed = [package.text for package in policy.findall(search)]
-        for package in packages_installed:
-            pkg_name, pkg_version = get_package_info(package)
-            if pkg_name in multiples:
-                try:
-                    if LooseVersion(pkg_version) < max(multiples[pkg_name]):
-                        updates_available.append(policy)
-                        break
-                except TypeError:
-                    pass
-
-    # Make a new list of just names (rather than the full XML)
-    updates_available_names = [
-        policy.findtext("general/name") for policy in updates_available
-    ]
+    # Find each product's newest version once, rather than for every
+    # package of every policy.
+    newest_versions = {}
+    for pkg_name, versions in multiples.items():
+        try:
+            newest_versions[pkg_name] = max(versions)
+        except TypeError:
+            pass
+
+    # No product has more than one version, so nothing can be outdated.
+    if not newest_versions:
+        return []
+
+    def is_outdated(package_name):
+        """Return whether a newer version of a package is available."""
+        pkg_name, pkg_version = get_package_info(package_name)
+        if pkg_name not in newest_versions:
+            return False
+        try:
+            return parse_version(pkg_version) < newest_versions[pkg_name]
+        except TypeError:
+            return False
+
+    # For each policy, lookup any packages it installs in the newest
+    # versions dictionary and see if there is a newer version available.
+    # The same few packages are installed by many policies, so decide
+    # each package name only once.
+    outdated = {}
+    updates_available_names = []
+    for policy_name, package_names in policy_packages:
+        for package_name in package_names:
+            if package_name not in outdated:
+                outdated[package_name] = is_outdated(package_name)
+            if outdated[package_name]:
+                updates_available_names.append(policy_name)
+                break
 
     return updates_available_names
 
 
 def log_warning(url, policy):
     """Print warning about flushing the logs if triggers in policy."""
-    if policy.findtext("general/frequency") != "Ongoing":
-        triggers = [
-            "trigger_checkin",
-            "trigger_enrollment_complete",
-            "trigger_login",
-            "trigger_logout",
-            "trigger_network_state_changed",
-            "trigger_startup",
-            "trigger_other",
-        ]
-        for trigger in triggers:
-            value = policy.findtext("general/" + trigger)
-            # Value can be string "false" or "" for "trigger_other".
-            if value not in [None, "False"]:
-                print("Remember to flush the policy logs!")
-                open_policy_log_in_browser(url, policy)
-                break
+    general = policy.find("general")
+    if general is None or general.findtext("frequency") == "Ongoing":
+        return
+    # One pass over general's children, rather than a search from the
+    # policy's root for each trigger.
+    for element in general:
+        # Value can be string "false" or "" for "trigger_other".
+        if element.tag in POLICY_TRIGGERS and (element.text or "") != "False":
+            print("Remember to flush the policy logs!")
+            open_policy_log_in_browser(url, policy)
+            break
 
 
 def open_policy_log_in_browser(jss_url, policy):
@@ -478,18 +1004,16 @@ def get_newest_pkg(options):
         must be in some format that get_package_info() can extract a
         version number.
     """
-    versions = {
-        get_package_info(package)[1]: package
-        for package in options
-        if get_package_info(package)[1]
-    }
-    if versions:
-        newest = max([LooseVersion(version) for version in versions])
-        result = versions[str(newest)]
-    else:
-        result = None
-
-    return result
+    # A single lazy pass: look each package up once, and keep only the
+    # newest so far rather than a list of every parsed version.
+    versions = ((package, get_package_info(package)[1]) for package in options)
+    newest, _ = max(
+        ((package, parse_version(version)) for package, version in versions
+         if version),
+        key=itemgetter(1),
+        default=(None, None),
+    )
+    return newest
 
 
 def _build_package_version_dict(package_list):
@@ -499,45 +1023,44 @@ def _build_package_version_dict(package_list):
         A dictionary of packages with multiple versions on the server:
             key: Package basename (string)
             value: List of package versions of type
-                distutil.version.LooseVersion
+                LooseVersion (see parse_version())
     """
-    packages = [package.name for package in package_list]
-    package_version_dict = {}
-    for package in packages:
-        package_name, package_version = get_package_info(package)
+    package_version_dict = defaultdict(list)
+    for package in package_list:
+        package_name, package_version = get_package_info(package.name)
         # Convert string version to something we can cmp.
         if package_name:
-            if package_name not in package_version_dict:
-                package_version_dict[package_name] = [LooseVersion(package_version)]
-            else:
-                package_version_dict[package_name].append(LooseVersion(package_version))
+            package_version_dict[package_name].append(
+                parse_version(package_version))
 
     # Narrow down packages list to only products which have multiple
     # packages on the JSS.
-    multiples = {
-        package: package_version_dict[package]
-        for package in package_version_dict
-        if len(package_version_dict[package]) > 1
+    return {
+        package: versions
+        for package, versions in package_version_dict.items()
+        if len(versions) > 1
     }
-    return multiples
 
 
+@functools.lru_cache(maxsize=4096)
+def parse_version(version):
+    """Return a LooseVersion for a version string.
+
+    Parsing is comparatively slow, and the same versions come up again
+    and again (e.g. once per policy which installs them), so parsed
+    versions are cached. Treat them as read-only.
+    """
+    return LooseVersion(version)
+
+
+# Unbounded: callers such as sort_package_list() pass over the whole
+# package list more than once, and an LRU smaller than that list would
+# evict every name just before it's needed again.
+@functools.lru_cache(maxsize=None)
 def get_package_info(package_name):
     """Return the package basename and version as a tuple."""
-    # Product name should be a combination of letters, numbers,
-    # hyphens, or underscores.
-    # A " ", "-", or "_" should separate the name from the version.
-    # whitespace, hyphens, or underscores
-    # The version then is any number of digits, followed by any number
-    # of letters, numbers, separated by "-", "_", "."s.
-    # Finally, an extension of ".pkg", ".pkg.zip", or ".dmg" must
-    # follow.
-    package_regex = (
-        r"^(?P<basename>[\w\s\-]+)[\s\-_]"
-        r"(?P<version>[\d]+[\w.\-]*)"
-        r"(?P<extension>\.(pkg(\.zip)?|dmg))$"
-    )
-    match = re.search(package_regex, package_name)
+    # Package references may have empty names.
+    match = PACKAGE_REGEX.match(package_name) if package_name else None
     if match:
         result = match.group("basename", "version")
     else:
@@ -598,8 +1121,10 @@ def prompt_user(options, expandable=False, flags=None):
 
     # Ask user to select an option until they make a valid choice.
     result = None
+    default = _get_default_option(options, flags)
+    prompt = _input_menu_text(expandable, flags)
     while not result:
-        choice = input(_input_menu_text(expandable, flags))
+        choice = input(prompt)
         if choice.isdigit() and in_range(int(choice), len(options)):
             result = options[int(choice)]
         elif choice.upper() == "F" and expandable:
@@ -607,21 +1132,30 @@ def prompt_user(options, expandable=False, flags=None):
             flagged_full_options = _add_flags_to_list(flags, expandable)
             display_options_list(flagged_full_options)
             options = expandable
+            default = _get_default_option(options, flags)
             # Turn off expandable so the next loop won't continue to
             # allow the "F" option.
             expandable = False
+            prompt = _input_menu_text(expandable, flags)
         elif choice == "" and flags and "DEFAULT" in flags:
-            results = [option for option in options if flags["DEFAULT"](option)]
-            # If there is a result, use it! Otherwise, just repeat the
+            # If there is a default, use it! Otherwise, just repeat the
             # menu.
-            if results:
-                result = results.pop()
+            result = default
         else:
             print("Invalid choice!")
 
     return result
 
 
+def _get_default_option(options, flags):
+    """Return the last option flagged "DEFAULT", or None."""
+    if not flags or "DEFAULT" not in flags:
+        return None
+    is_default = flags["DEFAULT"]
+    return next(
+        (option for option in reversed(options) if is_default(option)), None)
+
+
 def in_range(val, size):
     """Determine whether a value x is within the range 0 > x <= size."""
     return val < size and val >= 0
@@ -636,23 +1170,19 @@ def sort_package_list(packages):
 
     Returns:
         A list of string package names in order of
-        distutils.version.LooseVersion
+        LooseVersion (see parse_version())
     """
-    package_info = []
-    for package in packages:
+    def sort_key(package):
+        """Sort by upper-cased name, then version."""
         pkg_name, pkg_string_version = get_package_info(package)
-        # If the regex fails on either basename or version, skip.
-        if pkg_name and pkg_string_version:
-            # Upper the name for sorting, and convert version to a
-            # LooseVersion.
-            package_info.append(
-                (package, pkg_name.upper(), LooseVersion(pkg_string_version))
-            )
+        return (pkg_name.upper(), parse_version(pkg_string_version))
 
-    # Sort by name, then version.
-    package_info.sort(key=itemgetter(1, 2))
-    # Return just the original name.
-    return [package[0] for package in package_info]
+    # If the regex fails on either basename or version, skip. The
+    # package info is cached, so sort_key doesn't parse names again.
+    return sorted(
+        (package for package in packages if all(get_package_info(package))),
+        key=sort_key,
+    )
 
 
 def display_options_list(options):
@@ -701,8 +1231,20 @@ def update_name(policy, cur_pkg_name, new_pkg_name):
     changes = [cur_pkg_basename, cur_pkg_version, new_pkg_basename, new_pkg_version]
     if all(changes):
         name = policy_name_element.text
-        new_name = name.replace(cur_pkg_basename, new_pkg_basename)
-        new_name = new_name.replace(cur_pkg_version, new_pkg_version)
+        replacements = {
+            cur_pkg_version: new_pkg_version,
+            cur_pkg_basename: new_pkg_basename,
+        }
+        # Replace both in a single pass, trying the longest first so
+        # that a version which also appears in the product name can't
+        # split it up.
+        pattern = re.compile(
+            "|".join(
+                re.escape(old)
+                for old in sorted(replacements, key=len, reverse=True)
+            )
+        )
+        new_name = pattern.sub(lambda match: replacements[match.group(0)], name)
         print("Old name: %s" % name)
         print("New name: %s" % new_name)
         policy_name_element.text = new_name
@@ -735,19 +1277,26 @@ def _add_flags_to_list(flags, options):
     # Copy list to make sure we don't mutate any values.
     flagged_options = list(options)
     if flags:
-        # Make a list of matches, then append text to each match.
-        for flag in flags:
-            matches = [option for option in flagged_options if flags[flag](option)]
-            for match in matches:
-                flagged_options[flagged_options.index(match)] += " (%s)" % flag
+        # Flag each option in place as we go, rather than searching the
+        # list for every match. Later flags see earlier flags' text.
+        for index, option in enumerate(flagged_options):
+            for flag, matches in flags.items():
+                if matches(option):
+                    option += " (%s)" % flag
+            flagged_options[index] = option
     return flagged_options
 
 
 def policy_menu(policy_list, package_list):
     """Present user with an interactive policy menu.
 
+    Policies are retrieved with only their general and package
+    configuration data, which is discarded once read, so fetch the
+    chosen policy again before modifying it.
+
     Args:
-        jss_connection: A jss.JSS object.
+        policy_list: A jss.QuerySet of Policy objects.
+        package_list: A jss.QuerySet of Package objects.
     Returns:
         String name of selected policy.
     """
@@ -755,19 +1304,22 @@ def policy_menu(policy_list, package_list):
         "No policy specified in args: Building a list of policies which "
         "have newer packages available..."
     )
-    # Get full policy XML for all policies.
-    # jss_connection = JSSConnection.get()
+    # Only the name and packages of each policy are needed here, so
+    # skip downloading the rest of their XML, and only keep those
+    # while the rest of the policies arrive.
     print("Retrieving %i policies. Please wait..." % len(policy_list))
-    all_policies = policy_list.retrieve_all()
+    policy_packages = []
+    for policy in iter_retrieved(policy_list, subset=POLICY_MENU_SUBSET):
+        policy_packages.append(get_policy_packages(policy))
+        # Drop the parsed XML; its name is still known from the listing.
+        policy.clear()
+        policy.cached = False
 
     # Get lists of policies with available updates, and all
     # policies which install packages.
-    with_updates = get_updatable_policies(all_policies, package_list)
-    install_policies = [
-        policy.name
-        for policy in all_policies
-        if int(policy.findtext("package_configuration/packages/size")) > 0
-    ]
+    with_updates = find_updatable(policy_packages, package_list)
+    install_policies = [name for name, package_names in policy_packages
+                        if package_names]
 
     return prompt_user(with_updates, expandable=install_policies)
 
@@ -787,18 +1339,30 @@ def get_pkg_menu(packages, cur_pkg):
         String name of the package chosen by the user.
     """
     cur_pkg_basename, _ = get_package_info(cur_pkg)
-    # Build a list of ALL package names.
-    full_options = [package.name for package in packages]
-    # Build a list of package names with same product name as policy.
-    matching_options = [
-        option
-        for option in full_options
-        if cur_pkg_basename and cur_pkg_basename.upper() in option.upper()
-    ]
-
-    # Sort the package lists by name, then version.
+    # Match the product name case-insensitively without upper-casing a
+    # copy of every package's name.
+    if cur_pkg_basename:
+        matches_product = re.compile(
+            re.escape(cur_pkg_basename), re.IGNORECASE).search
+    else:
+        matches_product = None
+    # Build a list of ALL package names, and of package names with the
+    # same product name as policy, in one pass.
+    full_options = []
+    matching_options = []
+    for package in packages:
+        name = package.name
+        full_options.append(name)
+        if matches_product and matches_product(name):
+            matching_options.append(name)
+
+    # Sort the package lists by name, then version. The sort is
+    # stable, so the matches can be picked out of the sorted full list
+    # rather than sorted again.
     sorted_full_options = sort_package_list(full_options)
-    sorted_matching_options = sort_package_list(matching_options)
+    matching_names = set(matching_options)
+    sorted_matching_options = [
+        option for option in sorted_full_options if option in matching_names]
 
     # Build flags for menu.
     flags = {"CURRENT": lambda f: cur_pkg in f}
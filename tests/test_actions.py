@@ -0,0 +1,40 @@
+"""Tests for jss_helper_lib.actions."""
+
+import unittest
+
+from jss_helper_lib import actions
+
+
+class BuildArgparserTest(unittest.TestCase):
+    """Tests for build_argparser()."""
+
+    def test_separate_global_option_value(self):
+        """A global option's value is not taken for the subcommand."""
+        argv = ["--workers", "4", "scoped", "mygroup"]
+        args = actions.build_argparser(argv).parse_args(argv)
+        self.assertEqual(args.workers, 4)
+        self.assertEqual(args.subparser_name, "scoped")
+        self.assertEqual(args.group, "mygroup")
+
+    def test_joined_global_option_value(self):
+        """The --option=value form still finds the subcommand."""
+        argv = ["--workers=4", "scoped", "mygroup"]
+        args = actions.build_argparser(argv).parse_args(argv)
+        self.assertEqual(args.workers, 4)
+        self.assertEqual(args.group, "mygroup")
+
+
+class IdOrNameTest(unittest.TestCase):
+    """Tests for _id_or_name()."""
+
+    def test_decimal_search_is_id(self):
+        """All-decimal searches become integer IDs."""
+        self.assertEqual(actions._id_or_name("42"), 42)
+
+    def test_other_digits_are_names(self):
+        """Digits int() can't parse, like superscripts, stay names."""
+        self.assertEqual(actions._id_or_name("\u00b2"), "\u00b2")
+
+
+if __name__ == "__main__":
+    unittest.main()
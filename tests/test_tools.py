@@ -0,0 +1,57 @@
+"""Tests for jss_helper_lib.tools."""
+
+import unittest
+
+from jss_helper_lib import tools
+from jss_helper_lib.tools import jss
+
+
+class DiffTest(unittest.TestCase):
+    """Tests for diff()."""
+
+    def test_tabs_keep_gutter_aligned(self):
+        """Tab separated rows put the gutter in the same column."""
+        text1 = "Policies\nID: 1\tNAME: Foo\nID: 1234\tNAME: Bar\n"
+        text2 = "Policies\nID: 2\tNAME: Baz\nID: 5678\tNAME: Qux\n"
+        lines = tools.diff(text1, text2, width=80).splitlines()
+        # Left column is (80 - 3) // 2 wide, then a space.
+        gutter_column = 39
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0][gutter_column], " ")
+        for line in lines[1:]:
+            # Measure where a terminal would show the gutter.
+            self.assertEqual(line.expandtabs()[gutter_column], "|")
+
+
+class SearchForObjectTest(unittest.TestCase):
+    """Tests for search_for_object()."""
+
+    def test_non_decimal_digits_are_names(self):
+        """A name like a superscript digit is searched as a name."""
+        searches = []
+
+        def search_method(*args):
+            searches.extend(args)
+            return []
+
+        tools.search_for_object(search_method, "\u00b2")
+        self.assertEqual(searches, ["\u00b2"])
+
+
+class BuildResultsStringTest(unittest.TestCase):
+    """Tests for build_results_string()."""
+
+    def test_generator_keeps_every_result(self):
+        """Looking at the first result doesn't drop it from the output."""
+        computers = (
+            jss.Computer(None, data=jss.jssobject.Identity(
+                {"id": str(obj_id), "name": "mac%s" % obj_id}))
+            for obj_id in (1, 2, 3))
+        lines = tools.build_results_string(None, computers).splitlines()
+        self.assertEqual(
+            lines, ["ID: 1\tNAME: mac1", "ID: 2\tNAME: mac2",
+                    "ID: 3\tNAME: mac3"])
+
+
+if __name__ == "__main__":
+    unittest.main()